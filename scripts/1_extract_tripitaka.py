@@ -7,13 +7,21 @@ Download and extract Thai Tripitaka texts from GitHub repository
 import os
 import json
 import re
+import time
+import sqlite3
+import asyncio
+import aiohttp
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from pathlib import Path
-from bs4 import BeautifulSoup
+from lxml import etree
 from tqdm import tqdm
-from dataclasses import dataclass, asdict
-from typing import List, Optional
+from dataclasses import dataclass
+import msgspec
+from typing import Dict, List, Optional, Tuple, Union
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 
 # ============================================
 # Configuration
@@ -22,6 +30,33 @@ import argparse
 REPO_URL = "https://api.github.com/repos/jackchalat/tripitaka91/contents"
 RAW_BASE_URL = "https://raw.githubusercontent.com/jackchalat/tripitaka91/main"
 
+# Download parameters
+MAX_CONCURRENT_DOWNLOADS = 32  # In-flight requests across all hosts
+MAX_CONNECTIONS_PER_HOST = 16
+MAX_RETRIES = 5  # Attempts per file on 5xx/connection errors
+RETRY_BACKOFF = 0.5  # Seconds, doubled after each failed attempt
+
+# Optional token: raises the GitHub API rate limit from 60 to 5000 requests/hour
+GITHUB_TOKEN = os.getenv("GITHUB_TOKEN", "")
+
+# HTTP cache parameters
+HTTP_CACHE_FILE = ".http_cache.sqlite"  # Stored inside the output directory
+CACHE_EXPIRE_AFTER = 604800  # Seconds before a cached file is revalidated
+
+# HTML parsing parameters
+HTML_FEED_SIZE = 32768  # Characters fed to the parser at a time
+SKIP_TAGS = {'script', 'style', 'head', 'meta', 'link'}
+HEADER_TAGS = {'h1', 'h2', 'h3'}
+
+# Parallel parsing parameters
+PARSE_WORKERS = os.cpu_count()
+PARSE_CHUNKSIZE = 32  # Files handed to a worker process at a time
+
+# Text cleanup patterns
+ZERO_WIDTH_TABLE = str.maketrans('', '', '\u200b\u200c\u200d')
+WHITESPACE_RE = re.compile(r'\s+')
+SUTTA_FILE_EXT_RE = re.compile(r'\.(html|json)$')
+
 OUTPUT_DIR = Path(__file__).parent.parent / "assets" / "database" / "raw"
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -46,12 +81,14 @@ PITAKA_MAP = {
     'ab': 'abhidhamma',
 }
 
+# Nikaya code as a path segment, e.g. "dn/dn01.html" or "tipitaka/mn/mn10.html"
+NIKAYA_CODE_RE = re.compile(r'(?:^|/)(' + '|'.join(NIKAYA_MAP) + r')(?:/|$)')
+
 # ============================================
 # Data Classes
 # ============================================
 
-@dataclass
-class SuttaData:
+class SuttaData(msgspec.Struct):
     id: str
     sutta_id: str
     title_thai: str
@@ -63,31 +100,152 @@ class SuttaData:
     content_pali: Optional[str]
     source_file: str
 
+@dataclass
+class SuttaTask:
+    # Everything needed to build one SuttaData in a worker process
+    nikaya_code: str
+    base_name: str
+    nikaya: str
+    pitaka: str
+    source_file: str
+    json_file: Optional[str]
+    html_content: str
+    json_content: Optional[str]
+
+@dataclass
+class ParsedHtml:
+    title: str
+    text: str
+
+@dataclass
+class CachedResponse:
+    etag: Optional[str]
+    body: str
+    fetched_at: float
+
+# ============================================
+# HTTP Cache
+# ============================================
+
+class HttpCache:
+    """On-disk cache of downloaded files keyed by URL"""
+    
+    def __init__(self, path: Path, expire_after: int = CACHE_EXPIRE_AFTER):
+        self.expire_after = expire_after
+        self.conn = sqlite3.connect(str(path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                body TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            )
+        """)
+        self.conn.commit()
+    
+    def get(self, url: str) -> Optional[CachedResponse]:
+        """Get cached response for a URL"""
+        row = self.conn.execute(
+            "SELECT etag, body, fetched_at FROM responses WHERE url = ?", (url,)
+        ).fetchone()
+        return CachedResponse(*row) if row else None
+    
+    def is_fresh(self, cached: CachedResponse) -> bool:
+        """Check whether a cached response can be used without revalidation"""
+        return time.time() - cached.fetched_at < self.expire_after
+    
+    def put(self, url: str, etag: Optional[str], body: str):
+        """Store a downloaded response"""
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (url, etag, body, fetched_at) VALUES (?, ?, ?, ?)",
+                (url, etag, body, time.time())
+            )
+    
+    def touch(self, url: str):
+        """Mark a cached response as revalidated (HTTP 304)"""
+        with self.conn:
+            self.conn.execute(
+                "UPDATE responses SET fetched_at = ? WHERE url = ?", (time.time(), url)
+            )
+    
+    def close(self):
+        self.conn.close()
+
+def conditional_headers(cached: Optional[CachedResponse]) -> Dict[str, str]:
+    """Build If-None-Match header from a cached response"""
+    if cached and cached.etag:
+        return {'If-None-Match': cached.etag}
+    return {}
+
 # ============================================
 # Helper Functions
 # ============================================
 
 def clean_thai_text(text: str) -> str:
     """Clean and normalize Thai text"""
-    # Remove extra whitespace
-    text = re.sub(r'\s+', ' ', text)
-    # Remove zero-width characters
-    text = text.replace('\u200b', '')
-    text = text.replace('\u200c', '')
-    text = text.replace('\u200d', '')
-    # Normalize Thai characters
-    text = text.strip()
-    return text
-
-def extract_title_from_html(soup: BeautifulSoup) -> tuple[str, str]:
-    """Extract Thai and Pali titles from HTML"""
+    # Remove zero-width characters, then collapse extra whitespace
+    return WHITESPACE_RE.sub(' ', text.translate(ZERO_WIDTH_TABLE)).strip()
+
+class TextCollector:
+    """lxml parser target collecting visible text and the first header"""
+    
+    def __init__(self):
+        self.parts: List[str] = []
+        self.header_parts: List[str] = []
+        self.skip_depth = 0
+        self.header_depth = 0
+        self.header_done = False
+    
+    def start(self, tag: str, attrib: dict):
+        if tag in SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag in HEADER_TAGS and not self.header_done:
+            self.header_depth += 1
+        self._break()
+    
+    def end(self, tag: str):
+        if tag in SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag in HEADER_TAGS and self.header_depth:
+            self.header_depth -= 1
+            self.header_done = self.header_depth == 0
+        self._break()
+    
+    def data(self, data: str):
+        if self.skip_depth:
+            return
+        self.parts.append(data)
+        if self.header_depth:
+            self.header_parts.append(data)
+    
+    def _break(self):
+        # Separate text of adjacent elements; data() may split one text node
+        self.parts.append('\n')
+        if self.header_depth:
+            self.header_parts.append('\n')
+    
+    def close(self) -> ParsedHtml:
+        title = ''.join(line.strip() for line in ''.join(self.header_parts).splitlines())
+        return ParsedHtml(title=title, text=''.join(self.parts))
+
+def parse_html(html_content: str) -> ParsedHtml:
+    """Stream HTML through the parser without building a document tree"""
+    parser = etree.HTMLParser(target=TextCollector())
+    for i in range(0, len(html_content), HTML_FEED_SIZE):
+        parser.feed(html_content[i:i + HTML_FEED_SIZE])
+    return parser.close()
+
+def extract_title_from_html(parsed: ParsedHtml) -> tuple[str, str]:
+    """Extract Thai and Pali titles from parsed HTML"""
     thai_title = ""
     pali_title = ""
     
-    # Try to find title in header
-    header = soup.find(['h1', 'h2', 'h3'])
-    if header:
-        title_text = header.get_text(strip=True)
+    # Title comes from the first h1/h2/h3 header
+    if parsed.title:
+        title_text = parsed.title
         # Try to split Thai and Pali
         if '(' in title_text and ')' in title_text:
             parts = title_text.split('(')
@@ -98,16 +256,9 @@ def extract_title_from_html(soup: BeautifulSoup) -> tuple[str, str]:
     
     return thai_title, pali_title
 
-def extract_content_from_html(html_content: str) -> str:
-    """Extract text content from HTML"""
-    soup = BeautifulSoup(html_content, 'lxml')
-    
-    # Remove script and style elements
-    for element in soup(['script', 'style', 'head', 'meta', 'link']):
-        element.decompose()
-    
-    # Get text
-    text = soup.get_text(separator='\n')
+def extract_content_from_html(parsed: ParsedHtml) -> str:
+    """Extract text content from parsed HTML"""
+    text = parsed.text
     
     # Clean up
     lines = (line.strip() for line in text.splitlines())
@@ -116,62 +267,199 @@ def extract_content_from_html(html_content: str) -> str:
     
     return clean_thai_text(text)
 
+def meta_text(value) -> str:
+    """Coerce an upstream metadata value to text (numbers occur, e.g. vagga: 3)"""
+    return '' if value is None else str(value)
+
 def parse_json_meta(json_content: str, file_path: str) -> dict:
     """Parse JSON metadata file"""
     try:
         data = json.loads(json_content)
         return {
-            'sutta_id': data.get('sutta_id', ''),
-            'title': data.get('title', ''),
-            'title_pali': data.get('title_pali', ''),
-            'vagga': data.get('vagga', ''),
-            'nikaya': data.get('nikaya', ''),
+            'sutta_id': meta_text(data.get('sutta_id', '')),
+            'title': meta_text(data.get('title', '')),
+            'title_pali': meta_text(data.get('title_pali', '')),
+            'vagga': meta_text(data.get('vagga', '')),
+            'nikaya': meta_text(data.get('nikaya', '')),
         }
     except json.JSONDecodeError:
         return {}
 
+def get_nikaya_code_from_path(path: str) -> Optional[str]:
+    """Determine nikaya code from file path"""
+    path_lower = path.lower()
+    # Repository paths normally start with the nikaya directory
+    code = path_lower.split('/', 1)[0]
+    if code in NIKAYA_MAP:
+        return code
+    match = NIKAYA_CODE_RE.search(path_lower)
+    return match.group(1) if match else None
+
 def get_nikaya_from_path(path: str) -> str:
     """Determine nikaya from file path"""
-    path_lower = path.lower()
-    for code, name in NIKAYA_MAP.items():
-        if code in path_lower:
-            return name
-    return 'ไม่ระบุ'
+    return NIKAYA_MAP.get(get_nikaya_code_from_path(path), 'ไม่ระบุ')
 
 def get_pitaka_from_path(path: str) -> str:
     """Determine pitaka from file path"""
-    path_lower = path.lower()
-    for code, name in PITAKA_MAP.items():
-        if code in path_lower:
-            return name
-    return 'sutta'
+    return PITAKA_MAP.get(get_nikaya_code_from_path(path), 'sutta')
 
 # ============================================
 # Main Processing
 # ============================================
 
-def fetch_github_contents(path: str = "") -> List[dict]:
+def create_session() -> requests.Session:
+    """Create a keep-alive session with connection pooling and retries"""
+    session = requests.Session()
+    retry = Retry(
+        total=MAX_RETRIES,
+        status_forcelist=[429, 502, 503, 504],
+        backoff_factor=RETRY_BACKOFF,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=MAX_CONCURRENT_DOWNLOADS,
+        pool_maxsize=MAX_CONCURRENT_DOWNLOADS,
+        max_retries=retry,
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Accept-Encoding': 'gzip'})
+    if GITHUB_TOKEN:
+        session.headers.update({'Authorization': f'Bearer {GITHUB_TOKEN}'})
+    return session
+
+SESSION = create_session()
+
+def fetch_github_contents(path: str = "", cache: Optional[HttpCache] = None) -> List[dict]:
     """Fetch contents from GitHub API"""
     url = f"{REPO_URL}/{path}" if path else REPO_URL
-    response = requests.get(url)
+    
+    cached = cache.get(url) if cache else None
+    if cached and cache.is_fresh(cached):
+        return json.loads(cached.body)
+    
+    response = SESSION.get(url, headers=conditional_headers(cached))
+    if response.status_code == 304:
+        cache.touch(url)
+        return json.loads(cached.body)
+    
     response.raise_for_status()
+    if cache:
+        cache.put(url, response.headers.get('ETag'), response.text)
     return response.json()
 
-def download_file(raw_url: str) -> str:
-    """Download file content from raw URL"""
-    response = requests.get(raw_url)
-    response.raise_for_status()
-    return response.text
+async def fetch(
+    session: aiohttp.ClientSession,
+    semaphore: asyncio.Semaphore,
+    url: str,
+    cache: Optional[HttpCache] = None
+) -> str:
+    """Download file content, retrying with exponential backoff"""
+    cached = cache.get(url) if cache else None
+    if cached and cache.is_fresh(cached):
+        return cached.body
+    
+    async with semaphore:
+        for attempt in range(MAX_RETRIES):
+            try:
+                async with session.get(url, headers=conditional_headers(cached)) as response:
+                    if response.status == 304:
+                        cache.touch(url)
+                        return cached.body
+                    
+                    response.raise_for_status()
+                    text = await response.text()
+                    if cache:
+                        cache.put(url, response.headers.get('ETag'), text)
+                    return text
+            except aiohttp.ClientResponseError as e:
+                if e.status < 500 or attempt == MAX_RETRIES - 1:
+                    raise
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt == MAX_RETRIES - 1:
+                    raise
+            await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+async def fetch_all(
+    urls: List[str],
+    cache: Optional[HttpCache] = None
+) -> Dict[str, Union[str, Exception]]:
+    """Download all URLs concurrently, mapping each URL to its text or error"""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+    connector = aiohttp.TCPConnector(
+        limit=MAX_CONCURRENT_DOWNLOADS,
+        limit_per_host=MAX_CONNECTIONS_PER_HOST,
+    )
+    async with aiohttp.ClientSession(connector=connector) as session:
+        results = await asyncio.gather(
+            *[fetch(session, semaphore, url, cache) for url in urls],
+            return_exceptions=True,
+        )
+    return dict(zip(urls, results))
+
+def download_files(
+    urls: List[str],
+    cache: Optional[HttpCache] = None
+) -> Dict[str, Union[str, Exception]]:
+    """Download file contents from raw URLs"""
+    return asyncio.run(fetch_all(urls, cache))
+
+def parse_sutta(task: SuttaTask) -> Tuple[Optional[SuttaData], Optional[str]]:
+    """Build sutta data from downloaded files (runs in a worker process)"""
+    try:
+        # Extract text
+        parsed = parse_html(task.html_content)
+        content = extract_content_from_html(parsed)
+        
+        if not content.strip():
+            return None, None
+        
+        # Try to get metadata from JSON
+        meta = {}
+        if task.json_content is not None:
+            # A bad metadata file only loses the metadata, not the sutta
+            try:
+                meta = parse_json_meta(task.json_content, task.json_file)
+            except Exception:
+                meta = {}
+        
+        # Parse Thai and Pali titles
+        thai_title, pali_title = extract_title_from_html(parsed)
+        
+        # Use meta titles if available
+        if meta.get('title'):
+            thai_title = meta['title']
+        if meta.get('title_pali'):
+            pali_title = meta['title_pali']
+        
+        # Create sutta data
+        sutta = SuttaData(
+            id=f"{task.nikaya_code}_{task.base_name}",
+            sutta_id=meta.get('sutta_id', task.base_name),
+            title_thai=thai_title or task.base_name,
+            title_pali=pali_title,
+            pitaka=task.pitaka,
+            nikaya=task.nikaya,
+            vagga=meta.get('vagga'),
+            content_thai=content,
+            content_pali=None,
+            source_file=task.source_file,
+        )
+        return sutta, None
+        
+    except Exception as e:
+        return None, f"Error processing {task.base_name}: {e}"
 
-def process_tripitaka_repo():
+def process_tripitaka_repo(use_cache: bool = True):
     """Main function to process the Tripitaka repository"""
     all_suttas: List[SuttaData] = []
+    cache = HttpCache(OUTPUT_DIR / HTTP_CACHE_FILE) if use_cache else None
+    executor = ProcessPoolExecutor(max_workers=PARSE_WORKERS)
     
     print("Fetching repository structure...")
     
     try:
         # Get top-level directories (nikayas)
-        top_level = fetch_github_contents()
+        top_level = fetch_github_contents(cache=cache)
         
         for item in tqdm(top_level, desc="Processing directories"):
             if item['type'] != 'dir':
@@ -188,7 +476,7 @@ def process_tripitaka_repo():
             
             # Get files in this directory
             try:
-                contents = fetch_github_contents(item['name'])
+                contents = fetch_github_contents(item['name'], cache)
             except Exception as e:
                 print(f"  Error fetching {item['name']}: {e}")
                 continue
@@ -200,7 +488,7 @@ def process_tripitaka_repo():
                     continue
                 
                 name = file['name']
-                base_name = re.sub(r'\.(html|json)$', '', name)
+                base_name = SUTTA_FILE_EXT_RE.sub('', name)
                 
                 if base_name not in sutta_files:
                     sutta_files[base_name] = {}
@@ -210,66 +498,52 @@ def process_tripitaka_repo():
                 elif name.endswith('.json'):
                     sutta_files[base_name]['json'] = file['download_url']
             
-            # Process each sutta
-            for base_name, files in tqdm(sutta_files.items(), desc=f"  {nikaya_code}", leave=False):
+            # Download all files of this directory concurrently
+            urls = [url for files in sutta_files.values() if 'html' in files
+                    for url in files.values()]
+            print(f"  Downloading {len(urls)} files...")
+            downloaded = download_files(urls, cache)
+            
+            # Collect parse tasks for files that downloaded
+            tasks = []
+            for base_name, files in sutta_files.items():
                 if 'html' not in files:
                     continue
                 
-                try:
-                    # Download HTML content
-                    html_content = download_file(files['html'])
-                    
-                    # Extract text
-                    content = extract_content_from_html(html_content)
-                    
-                    if not content.strip():
-                        continue
-                    
-                    # Try to get metadata from JSON
-                    meta = {}
-                    if 'json' in files:
-                        try:
-                            json_content = download_file(files['json'])
-                            meta = parse_json_meta(json_content, files['json'])
-                        except:
-                            pass
-                    
-                    # Parse Thai and Pali titles
-                    soup = BeautifulSoup(html_content, 'lxml')
-                    thai_title, pali_title = extract_title_from_html(soup)
-                    
-                    # Use meta titles if available
-                    if meta.get('title'):
-                        thai_title = meta['title']
-                    if meta.get('title_pali'):
-                        pali_title = meta['title_pali']
-                    
-                    # Create sutta data
-                    sutta = SuttaData(
-                        id=f"{nikaya_code}_{base_name}",
-                        sutta_id=meta.get('sutta_id', base_name),
-                        title_thai=thai_title or base_name,
-                        title_pali=pali_title,
-                        pitaka=pitaka,
-                        nikaya=nikaya,
-                        vagga=meta.get('vagga'),
-                        content_thai=content,
-                        content_pali=None,
-                        source_file=files['html'],
-                    )
-                    
-                    all_suttas.append(sutta)
-                    
-                except Exception as e:
-                    print(f"    Error processing {base_name}: {e}")
+                html_content = downloaded[files['html']]
+                if isinstance(html_content, Exception):
+                    print(f"    Error processing {base_name}: {html_content}")
                     continue
+                
+                json_content = downloaded.get(files.get('json'))
+                if isinstance(json_content, Exception):
+                    json_content = None
+                
+                tasks.append(SuttaTask(
+                    nikaya_code=nikaya_code,
+                    base_name=base_name,
+                    nikaya=nikaya,
+                    pitaka=pitaka,
+                    source_file=files['html'],
+                    json_file=files.get('json'),
+                    html_content=html_content,
+                    json_content=json_content,
+                ))
+            
+            # Parse each sutta across all cores
+            results = executor.map(parse_sutta, tasks, chunksize=PARSE_CHUNKSIZE)
+            for sutta, error in tqdm(results, total=len(tasks), desc=f"  {nikaya_code}", leave=False):
+                if error:
+                    print(f"    {error}")
+                elif sutta:
+                    all_suttas.append(sutta)
         
         # Save all extracted data
         print(f"\nExtracted {len(all_suttas)} suttas")
         
         output_file = OUTPUT_DIR / "tripitaka_extracted.json"
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump([asdict(s) for s in all_suttas], f, ensure_ascii=False, indent=2)
+        # msgspec encodes the structs in one pass, without per-sutta dicts
+        output_file.write_bytes(msgspec.json.encode(all_suttas))
         
         print(f"Saved to {output_file}")
         
@@ -286,6 +560,11 @@ def process_tripitaka_repo():
     except Exception as e:
         print(f"Error: {e}")
         raise
+    
+    finally:
+        executor.shutdown()
+        if cache:
+            cache.close()
 
 # ============================================
 # Entry Point
@@ -295,9 +574,11 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Extract Thai Tripitaka data')
     parser.add_argument('--output', '-o', type=str, default=str(OUTPUT_DIR),
                         help='Output directory')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Skip the on-disk HTTP cache')
     args = parser.parse_args()
     
     OUTPUT_DIR = Path(args.output)
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
     
-    process_tripitaka_repo()
+    process_tripitaka_repo(use_cache=not args.no_cache)
@@ -5,20 +5,26 @@ Split texts into chunks and generate vector embeddings
 """
 
 import os
-import json
 import re
 from pathlib import Path
-from typing import List, Optional
-from dataclasses import dataclass, asdict
+from typing import Iterable, Iterator, List, Optional, Tuple
+from itertools import islice
 from tqdm import tqdm
+import msgspec
+import ijson
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 
 # NLP imports
 try:
+    import torch
     from sentence_transformers import SentenceTransformer
+    from transformers import AutoTokenizer
     import numpy as np
+    import pyarrow as pa
+    import pyarrow.parquet as pq
 except ImportError:
-    print("Please install: pip install sentence-transformers numpy")
+    print("Please install: pip install torch sentence-transformers numpy pyarrow")
     raise
 
 # ============================================
@@ -28,6 +34,10 @@ except ImportError:
 INPUT_DIR = Path(__file__).parent.parent / "assets" / "database" / "raw"
 OUTPUT_DIR = Path(__file__).parent.parent / "assets" / "database" / "processed"
 
+# Output files: chunk metadata table + embedding matrix aligned by embedding_idx
+CHUNKS_FILE = "tripitaka_chunks.parquet"
+EMBEDDINGS_FILE = "tripitaka_embeddings.npy"
+
 # Embedding model - multilingual for Thai support
 EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
 # Alternative Thai-specific models:
@@ -35,16 +45,36 @@ EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
 # - "kornwtp/ConGen-simcse-model-thai-prompt"
 
 # Chunking parameters
-CHUNK_SIZE = 500  # Target characters per chunk
-CHUNK_OVERLAP = 50  # Character overlap between chunks
-MIN_CHUNK_SIZE = 100  # Minimum chunk size
+CHUNK_TOKENS = 112  # Model tokens per chunk (model limit is 128 incl. special tokens)
+CHUNK_TOKEN_OVERLAP = 16  # Token overlap between chunks
+CHUNK_SIZE = 500  # Target characters per chunk when chunking by characters
+CHUNK_OVERLAP = 50  # Character overlap between chunks when chunking by characters
+MIN_CHUNK_SIZE = 100  # Minimum chunk size in characters
+
+# Parallel chunking parameters
+CHUNK_WORKERS = os.cpu_count()
+CHUNK_TASK_SIZE = 64  # Suttas handed to a worker process at a time
+CHUNK_BATCH_SIZE = 4096  # Suttas read from the input and in flight at a time
+
+# Sentence delimiters: punctuation (incl. Indic danda) or paragraph breaks,
+# captured so they stay attached to the preceding sentence
+SENTENCE_END_RE = re.compile(r'([。\.！!？?।]+|\n{2,})\s*')
 
 # ============================================
 # Data Classes
 # ============================================
 
-@dataclass
-class TextChunk:
+class SuttaInput(msgspec.Struct):
+    # Only the fields chunking needs; the rest of each record is skipped on decode
+    id: str
+    content_thai: str = ""
+    title_thai: str = ""
+    title_pali: Optional[str] = ""
+    pitaka: str = ""
+    nikaya: str = ""
+    vagga: Optional[str] = None
+
+class TextChunk(msgspec.Struct):
     id: str
     source_id: str
     content: str
@@ -52,7 +82,7 @@ class TextChunk:
     total_chunks: int
     char_start: int
     char_end: int
-    embedding: Optional[List[float]] = None
+    embedding: Optional[np.ndarray] = None
     
     # Metadata
     title_thai: str = ""
@@ -65,34 +95,81 @@ class TextChunk:
 # Text Processing
 # ============================================
 
+def sentence_spans_thai(text: str) -> List[Tuple[int, int]]:
+    """Find (start, end) offsets of Thai sentences, delimiters included"""
+    spans = []
+    pos = 0
+    boundaries = [(m.end(1), m.end()) for m in SENTENCE_END_RE.finditer(text)]
+    boundaries.append((len(text), len(text)))
+    
+    for end, next_pos in boundaries:
+        start = pos
+        # Trim surrounding whitespace so offsets point at the sentence itself
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if start < end:
+            spans.append((start, end))
+        pos = next_pos
+    
+    return spans
+
 def split_into_sentences_thai(text: str) -> List[str]:
     """Split Thai text into sentences"""
-    # Thai sentence endings
-    sentence_endings = ['။', '။', '\n\n', '\n']
-    
-    # Also split on common patterns
-    patterns = [
-        r'([。\.！!？?])\s*',  # Punctuation + space
-        r'([।।])\s*',  # Thai/Indic punctuation
-        r'(\n\n+)',  # Double newlines
-    ]
-    
-    sentences = [text]
-    for pattern in patterns:
-        new_sentences = []
-        for s in sentences:
-            parts = re.split(pattern, s)
-            # Combine delimiter with preceding text
-            for i in range(0, len(parts) - 1, 2):
-                if i + 1 < len(parts):
-                    new_sentences.append(parts[i] + parts[i + 1])
-                else:
-                    new_sentences.append(parts[i])
-            if len(parts) % 2 == 1 and parts[-1].strip():
-                new_sentences.append(parts[-1])
-        sentences = [s for s in new_sentences if s.strip()]
-    
-    return [s.strip() for s in sentences if s.strip()]
+    return [text[start:end] for start, end in sentence_spans_thai(text)]
+
+def sentence_windows(text: str, chunk_size: int, overlap: int) -> List[Tuple[int, int]]:
+    """Group whole sentences into windows of at most `chunk_size` characters
+    
+    Consecutive windows share the trailing sentences of the previous window
+    that fit within `overlap` characters.
+    """
+    spans = sentence_spans_thai(text)
+    windows = []
+    window_start = 0  # Index of the first sentence in the current window
+    
+    for i, (_, sentence_end) in enumerate(spans):
+        if i > window_start and sentence_end - spans[window_start][0] > chunk_size:
+            # Sentence doesn't fit: close the window at the previous sentence
+            prev_end = spans[i - 1][1]
+            windows.append((spans[window_start][0], prev_end))
+            
+            # Start the next window with the trailing sentences that fit in overlap
+            next_start = i
+            while next_start - 1 > window_start and prev_end - spans[next_start - 1][0] <= overlap:
+                next_start -= 1
+            window_start = next_start
+    
+    # Don't forget the last window
+    if spans:
+        windows.append((spans[window_start][0], spans[-1][1]))
+    
+    return windows
+
+def token_windows(text: str, tokenizer, max_tokens: int, overlap: int) -> List[Tuple[int, int]]:
+    """Split text into windows of at most `max_tokens` model tokens
+    
+    Windows are mapped back to character offsets through the tokenizer's
+    offset mapping, so chunk text is sliced from `text` rather than decoded.
+    """
+    offsets = tokenizer(
+        text, add_special_tokens=False, return_offsets_mapping=True, verbose=False
+    )['offset_mapping']
+    windows = []
+    step = max(1, max_tokens - overlap)
+    
+    for first in range(0, len(offsets), step):
+        last = min(first + max_tokens, len(offsets)) - 1
+        start, end = offsets[first][0], offsets[last][1]
+        # Tokens may carry the preceding space
+        while start < end and text[start].isspace():
+            start += 1
+        windows.append((start, end))
+        if last == len(offsets) - 1:
+            break
+    
+    return windows
 
 def create_chunks(
     text: str,
@@ -100,67 +177,42 @@ def create_chunks(
     metadata: dict,
     chunk_size: int = CHUNK_SIZE,
     overlap: int = CHUNK_OVERLAP,
-    min_size: int = MIN_CHUNK_SIZE
+    min_size: int = MIN_CHUNK_SIZE,
+    tokenizer=None,
+    chunk_tokens: int = CHUNK_TOKENS,
+    token_overlap: int = CHUNK_TOKEN_OVERLAP
 ) -> List[TextChunk]:
-    """Create text chunks with overlap"""
+    """Create text chunks with overlap
+    
+    With a tokenizer, chunks are sized in model tokens so none are truncated
+    by the encoder; otherwise they are sentence windows sized in characters.
+    Either way chunk content is sliced straight from `text`, so
+    char_start/char_end are exact offsets.
+    """
     
     if not text or len(text) < min_size:
         return []
     
-    sentences = split_into_sentences_thai(text)
+    if tokenizer is not None:
+        windows = token_windows(text, tokenizer, chunk_tokens, token_overlap)
+    else:
+        windows = sentence_windows(text, chunk_size, overlap)
     
     chunks = []
-    current_chunk = ""
-    current_start = 0
-    char_pos = 0
-    chunk_index = 0
-    
-    for sentence in sentences:
-        sentence_len = len(sentence)
-        
-        if len(current_chunk) + sentence_len <= chunk_size:
-            current_chunk += " " + sentence if current_chunk else sentence
-        else:
-            # Save current chunk if it meets minimum size
-            if len(current_chunk.strip()) >= min_size:
-                chunk = TextChunk(
-                    id=f"{source_id}_chunk_{chunk_index}",
-                    source_id=source_id,
-                    content=current_chunk.strip(),
-                    chunk_index=chunk_index,
-                    total_chunks=0,  # Will update later
-                    char_start=current_start,
-                    char_end=char_pos,
-                    **metadata
-                )
-                chunks.append(chunk)
-                chunk_index += 1
-            
-            # Start new chunk with overlap
-            if overlap > 0 and current_chunk:
-                # Take last part of previous chunk
-                overlap_text = current_chunk[-overlap:] if len(current_chunk) > overlap else current_chunk
-                current_chunk = overlap_text + " " + sentence
-                current_start = char_pos - len(overlap_text)
-            else:
-                current_chunk = sentence
-                current_start = char_pos
-        
-        char_pos += sentence_len + 1  # +1 for space/newline
-    
-    # Don't forget the last chunk
-    if len(current_chunk.strip()) >= min_size:
-        chunk = TextChunk(
+    for start, end in windows:
+        if end - start < min_size:
+            continue
+        chunk_index = len(chunks)
+        chunks.append(TextChunk(
             id=f"{source_id}_chunk_{chunk_index}",
             source_id=source_id,
-            content=current_chunk.strip(),
+            content=text[start:end],
             chunk_index=chunk_index,
-            total_chunks=0,
-            char_start=current_start,
-            char_end=char_pos,
+            total_chunks=0,  # Will update later
+            char_start=start,
+            char_end=end,
             **metadata
-        )
-        chunks.append(chunk)
+        ))
     
     # Update total_chunks
     total = len(chunks)
@@ -176,62 +228,135 @@ def create_chunks(
 class EmbeddingGenerator:
     def __init__(self, model_name: str = EMBEDDING_MODEL):
         print(f"Loading embedding model: {model_name}")
-        self.model = SentenceTransformer(model_name)
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.model = SentenceTransformer(model_name, device=device)
+        if device == 'cuda':
+            self.model = self.model.half()
         self.embedding_dim = self.model.get_sentence_embedding_dimension()
         print(f"Embedding dimension: {self.embedding_dim}")
     
-    def generate_embeddings(self, texts: List[str], batch_size: int = 32) -> List[List[float]]:
-        """Generate embeddings for a list of texts"""
+    def generate_embeddings(self, texts: List[str], batch_size: int = 128) -> np.ndarray:
+        """Generate L2-normalized embeddings as a (len(texts), dim) float32 matrix"""
         print(f"Generating embeddings for {len(texts)} texts...")
         
-        embeddings = []
-        for i in tqdm(range(0, len(texts), batch_size), desc="Embedding"):
-            batch = texts[i:i + batch_size]
-            batch_embeddings = self.model.encode(batch, convert_to_numpy=True)
-            embeddings.extend(batch_embeddings.tolist())
-        
-        return embeddings
+        # encode() batches internally and sorts inputs by length to minimize padding
+        embeddings = self.model.encode(
+            texts,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=True
+        )
+        return embeddings.astype(np.float32, copy=False)
 
 # ============================================
 # Main Processing
 # ============================================
 
-def process_suttas(input_file: Path, output_dir: Path, generate_embeddings: bool = True):
-    """Process extracted suttas: chunk and embed"""
+def save_chunks(chunks: List[TextChunk], output_dir: Path, embeddings: Optional[np.ndarray]):
+    """Save chunk metadata as Parquet and embeddings as a float32 .npy matrix"""
+    columns = {
+        name: [getattr(c, name) for c in chunks]
+        for name in TextChunk.__struct_fields__ if name != 'embedding'
+    }
+    # Row i of the embedding matrix belongs to chunk i
+    columns['embedding_idx'] = (
+        list(range(len(chunks))) if embeddings is not None else [None] * len(chunks)
+    )
+    
+    chunks_file = output_dir / CHUNKS_FILE
+    pq.write_table(pa.table(columns), chunks_file, compression='zstd')
+    print(f"Saved {len(chunks)} chunks to {chunks_file}")
     
-    # Load extracted data
-    print(f"Loading data from {input_file}")
-    with open(input_file, 'r', encoding='utf-8') as f:
-        suttas = json.load(f)
+    if embeddings is not None:
+        embeddings_file = output_dir / EMBEDDINGS_FILE
+        np.save(embeddings_file, np.asarray(embeddings, dtype=np.float32))
+        print(f"Saved {embeddings.shape[0]}x{embeddings.shape[1]} embeddings to {embeddings_file}")
+
+# Per-worker tokenizer for token-budget chunking (None: chunk by characters)
+_tokenizer = None
+
+def init_chunk_worker(tokenizer_name: Optional[str]):
+    """Load the embedding model's tokenizer once per worker process"""
+    global _tokenizer
+    if tokenizer_name:
+        os.environ.setdefault('TOKENIZERS_PARALLELISM', 'false')
+        _tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+
+def chunk_sutta(sutta: SuttaInput) -> List[TextChunk]:
+    """Chunk one sutta (runs in a worker process)"""
+    metadata = {
+        'title_thai': sutta.title_thai,
+        'title_pali': sutta.title_pali,
+        'pitaka': sutta.pitaka,
+        'nikaya': sutta.nikaya,
+        'vagga': sutta.vagga,
+    }
     
-    print(f"Loaded {len(suttas)} suttas")
+    return create_chunks(
+        text=sutta.content_thai,
+        source_id=sutta.id,
+        metadata=metadata,
+        tokenizer=_tokenizer
+    )
+
+def iter_suttas(input_file: Path) -> Iterator[SuttaInput]:
+    """Stream suttas from the extracted JSON array one record at a time
     
-    # Initialize embedding model
-    embedder = None
-    if generate_embeddings:
-        embedder = EmbeddingGenerator()
+    Records that don't match SuttaInput are reported and skipped so one bad
+    record can't abort the run.
+    """
+    with open(input_file, 'rb') as f:
+        for item in ijson.items(f, 'item'):
+            try:
+                yield msgspec.convert(item, SuttaInput)
+            except msgspec.ValidationError as e:
+                sutta_id = item.get('id') if isinstance(item, dict) else None
+                print(f"Warning: skipping sutta {sutta_id}: {e}")
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    """Yield successive lists of up to `size` items"""
+    it = iter(items)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+def process_suttas(
+    input_file: Path,
+    output_dir: Path,
+    generate_embeddings: bool = True,
+    chunk_by_tokens: bool = True
+):
+    """Process extracted suttas: chunk and embed"""
+    
+    # Stream extracted data so only a batch of suttas is resident at a time
+    print(f"Streaming data from {input_file}")
     
-    # Process each sutta
+    # Process each sutta across all cores
     all_chunks = []
+    sutta_count = 0
     
-    for sutta in tqdm(suttas, desc="Chunking"):
-        metadata = {
-            'title_thai': sutta.get('title_thai', ''),
-            'title_pali': sutta.get('title_pali', ''),
-            'pitaka': sutta.get('pitaka', ''),
-            'nikaya': sutta.get('nikaya', ''),
-            'vagga': sutta.get('vagga'),
-        }
-        
-        chunks = create_chunks(
-            text=sutta.get('content_thai', ''),
-            source_id=sutta['id'],
-            metadata=metadata
-        )
-        
-        all_chunks.extend(chunks)
+    tokenizer_name = EMBEDDING_MODEL if chunk_by_tokens else None
+    with ProcessPoolExecutor(
+        max_workers=CHUNK_WORKERS,
+        initializer=init_chunk_worker,
+        initargs=(tokenizer_name,)
+    ) as executor, tqdm(desc="Chunking", unit=" suttas") as progress:
+        for batch in batched(iter_suttas(input_file), CHUNK_BATCH_SIZE):
+            for chunks in executor.map(chunk_sutta, batch, chunksize=CHUNK_TASK_SIZE):
+                all_chunks.extend(chunks)
+            sutta_count += len(batch)
+            progress.update(len(batch))
     
-    print(f"Created {len(all_chunks)} chunks")
+    print(f"Created {len(all_chunks)} chunks from {sutta_count} suttas")
+    
+    # Initialize embedding model (after the worker processes are gone, so
+    # no CUDA context is ever forked)
+    embedder = None
+    if generate_embeddings:
+        embedder = EmbeddingGenerator()
     
     # Generate embeddings
     if embedder:
@@ -243,21 +368,13 @@ def process_suttas(input_file: Path, output_dir: Path, generate_embeddings: bool
     
     # Save processed chunks
     output_dir.mkdir(parents=True, exist_ok=True)
-    output_file = output_dir / "tripitaka_chunks.json"
-    
-    # Convert to dict for JSON serialization
-    chunks_data = [asdict(c) for c in all_chunks]
-    
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(chunks_data, f, ensure_ascii=False, indent=2)
-    
-    print(f"Saved {len(chunks_data)} chunks to {output_file}")
+    save_chunks(all_chunks, output_dir, embeddings if embedder else None)
     
     # Print statistics
     print("\nStatistics:")
-    print(f"  Total suttas: {len(suttas)}")
+    print(f"  Total suttas: {sutta_count}")
     print(f"  Total chunks: {len(all_chunks)}")
-    print(f"  Average chunks per sutta: {len(all_chunks) / len(suttas):.1f}")
+    print(f"  Average chunks per sutta: {len(all_chunks) / sutta_count:.1f}")
     
     # Chunk size distribution
     sizes = [len(c.content) for c in all_chunks]
@@ -281,10 +398,13 @@ if __name__ == "__main__":
                         help='Output directory')
     parser.add_argument('--no-embed', action='store_true',
                         help='Skip embedding generation')
+    parser.add_argument('--char-chunks', action='store_true',
+                        help='Size chunks in characters instead of model tokens')
     args = parser.parse_args()
     
     process_suttas(
         input_file=Path(args.input),
         output_dir=Path(args.output),
-        generate_embeddings=not args.no_embed
+        generate_embeddings=not args.no_embed,
+        chunk_by_tokens=not args.char_chunks
     )
@@ -5,13 +5,27 @@ Create SQLite database with FTS5 and vector search support
 """
 
 import os
-import json
+import queue
 import sqlite3
+import threading
+from contextlib import closing
 from pathlib import Path
-from typing import List, Optional
+from typing import BinaryIO, Iterable, Iterator, List, Optional
+from itertools import chain, islice
+from operator import itemgetter
 from tqdm import tqdm
 import argparse
 import struct
+import ijson
+import numpy as np
+import pyarrow.parquet as pq
+
+# Optional: sqlite-vec builds a compiled kNN index over the embeddings
+# (opt-in with --vector-index; the app reads the int8 BLOBs instead)
+try:
+    import sqlite_vec
+except ImportError:
+    sqlite_vec = None
 
 # ============================================
 # Configuration
@@ -22,11 +36,41 @@ OUTPUT_DIR = Path(__file__).parent.parent / "assets" / "database"
 
 DB_NAME = "tripitaka_v1.sqlite"
 
+# Inputs written by script 2
+CHUNKS_FILE = "tripitaka_chunks.parquet"
+EMBEDDINGS_FILE = "tripitaka_embeddings.npy"
+
+# Contiguous (N, dim) float16 embedding matrix written next to the database;
+# chunks.embedding_row is the row index into it
+EMBEDDING_MATRIX_SUFFIX = ".embeddings.f16.bin"
+
+# Rows bound per executemany call and committed per transaction, so each
+# transaction's dirty pages fit comfortably in the page cache
+BATCH_SIZE = 5000
+
+# Parsed chunks handed from the reader thread to the writer per batch, and
+# how many batches may be waiting
+PREFETCH_BATCH_SIZE = 1000
+PREFETCH_DEPTH = 4
+
+# Bytes read per call when streaming legacy JSON input
+JSON_READ_SIZE = 1 << 20
+
+# Optional sqlite-vec kNN table of float32 vectors; its rowid is
+# chunks.embedding_row
+VECTOR_INDEX_TABLE = "vec_idx"
+VECTOR_INDEX_METRIC = "cosine"
+
+# Model used by script 2 to generate the embeddings
+EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
 # ============================================
 # Database Schema
 # ============================================
 
-SCHEMA_SQL = """
+# Tables only; everything that has to be maintained per row is created
+# after the bulk load by SCHEMA_INDEXES_SQL
+SCHEMA_TABLES_SQL = """
 -- Metadata table
 CREATE TABLE IF NOT EXISTS metadata (
     key TEXT PRIMARY KEY,
@@ -47,17 +91,6 @@ CREATE TABLE IF NOT EXISTS suttas (
     created_at INTEGER DEFAULT (strftime('%s', 'now'))
 );
 
--- FTS5 virtual table for full-text search
-CREATE VIRTUAL TABLE IF NOT EXISTS suttas_fts USING fts5(
-    id UNINDEXED,
-    title_thai,
-    title_pali,
-    content_thai,
-    content='suttas',
-    content_rowid='rowid',
-    tokenize='unicode61'
-);
-
 -- Chunks table for RAG
 CREATE TABLE IF NOT EXISTS chunks (
     id TEXT PRIMARY KEY,
@@ -72,16 +105,18 @@ CREATE TABLE IF NOT EXISTS chunks (
     pitaka TEXT,
     nikaya TEXT,
     vagga TEXT,
+    embedding_row INTEGER,
     created_at INTEGER DEFAULT (strftime('%s', 'now')),
     FOREIGN KEY (source_id) REFERENCES suttas(id)
 );
 
--- Embeddings table (stored as BLOB for efficiency)
+-- Embeddings table (int8 BLOB: float32 scale + one int8 per dimension)
 CREATE TABLE IF NOT EXISTS embeddings (
     chunk_id TEXT PRIMARY KEY,
     embedding BLOB NOT NULL,
     dimensions INTEGER NOT NULL,
     model TEXT,
+    is_quantized INTEGER NOT NULL DEFAULT 1,
     created_at INTEGER DEFAULT (strftime('%s', 'now')),
     FOREIGN KEY (chunk_id) REFERENCES chunks(id)
 );
@@ -119,14 +154,32 @@ CREATE TABLE IF NOT EXISTS user_embeddings (
     created_at INTEGER DEFAULT (strftime('%s', 'now')),
     FOREIGN KEY (chunk_id) REFERENCES user_chunks(id)
 );
+"""
 
+# Created after the bulk load: building indexes over populated tables is
+# much cheaper than maintaining them row by row
+SCHEMA_INDEXES_SQL = """
 -- Indexes
 CREATE INDEX IF NOT EXISTS idx_suttas_pitaka ON suttas(pitaka);
 CREATE INDEX IF NOT EXISTS idx_suttas_nikaya ON suttas(nikaya);
 CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks(source_id);
 CREATE INDEX IF NOT EXISTS idx_user_docs_status ON user_documents(status);
 
--- Triggers to keep FTS in sync
+-- FTS5 virtual table for full-text search (populated by a 'rebuild')
+CREATE VIRTUAL TABLE IF NOT EXISTS suttas_fts USING fts5(
+    id UNINDEXED,
+    title_thai,
+    title_pali,
+    content_thai,
+    content='suttas',
+    content_rowid='rowid',
+    tokenize='unicode61'
+);
+"""
+
+# Triggers to keep FTS in sync with later incremental updates. A fresh build
+# creates them only after FTS has been rebuilt in one pass over the data.
+FTS_TRIGGERS_SQL = """
 CREATE TRIGGER IF NOT EXISTS suttas_ai AFTER INSERT ON suttas BEGIN
     INSERT INTO suttas_fts(rowid, id, title_thai, title_pali, content_thai)
     VALUES (new.rowid, new.id, new.title_thai, new.title_pali, new.content_thai);
@@ -145,36 +198,292 @@ CREATE TRIGGER IF NOT EXISTS suttas_au AFTER UPDATE ON suttas BEGIN
 END;
 """
 
+# Insert statements are shared constants so every batch flush hits the
+# connection's prepared-statement cache instead of recompiling. Fresh builds
+# use them as is; upserting builders use the OR REPLACE form (see as_upsert).
+INSERT_SUTTA_SQL = """
+INSERT INTO suttas
+(id, sutta_id, title_thai, title_pali, pitaka, nikaya, vagga, content_thai)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+INSERT_CHUNK_SQL = """
+INSERT INTO chunks
+(id, source_id, content, chunk_index, total_chunks, char_start, char_end,
+ title_thai, title_pali, pitaka, nikaya, vagga, embedding_row)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+INSERT_EMB_SQL = """
+INSERT INTO embeddings
+(chunk_id, embedding, dimensions, model, is_quantized)
+VALUES (?, ?, ?, ?, ?)
+"""
+
+INSERT_VEC_SQL = f"""
+INSERT INTO {VECTOR_INDEX_TABLE} (rowid, embedding)
+VALUES (?, ?)
+"""
+
 # ============================================
 # Helper Functions
 # ============================================
 
-def embedding_to_blob(embedding: List[float]) -> bytes:
-    """Convert embedding list to binary blob"""
-    return struct.pack(f'{len(embedding)}f', *embedding)
+def as_upsert(sql: str) -> str:
+    """Turn a plain INSERT statement into its INSERT OR REPLACE form"""
+    return sql.replace("INSERT INTO", "INSERT OR REPLACE INTO", 1)
+
+def remove_database(path: Path):
+    """Delete a database file together with its WAL and shared-memory files"""
+    for suffix in ('', '-wal', '-shm'):
+        Path(f"{path}{suffix}").unlink(missing_ok=True)
+
+def embeddings_to_blobs(matrix: np.ndarray) -> List[memoryview]:
+    """Quantize an (n, dim) matrix to int8 with per-row scales and pack as blobs
+    
+    Layout: little-endian float32 scale, then one int8 per dimension. The
+    blobs are views into one buffer allocated per batch; sqlite3 copies
+    them when binding.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    n, dimensions = matrix.shape
+    scales = np.max(np.abs(matrix), axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    
+    stride = 4 + dimensions
+    packed = np.empty((n, stride), dtype=np.uint8)
+    packed[:, :4] = scales.astype('<f4').view(np.uint8).reshape(n, 4)
+    packed[:, 4:] = np.round(matrix / scales[:, None]).astype(np.int8).view(np.uint8)
+    
+    buf = memoryview(packed.reshape(-1))
+    return [buf[i * stride:(i + 1) * stride] for i in range(n)]
+
+def embedding_to_blob(embedding: np.ndarray) -> bytes:
+    """Quantize a single embedding to an int8 blob"""
+    return bytes(embeddings_to_blobs(np.asarray(embedding, dtype=np.float32)[None, :])[0])
 
 def blob_to_embedding(blob: bytes, dimensions: int) -> List[float]:
-    """Convert binary blob to embedding list"""
-    return list(struct.unpack(f'{dimensions}f', blob))
+    """Convert binary blob back to (dequantized) embedding list"""
+    (scale,) = struct.unpack_from('<f', blob)
+    q = np.frombuffer(blob, dtype=np.int8, count=dimensions, offset=4)
+    return (q.astype(np.float32) * scale).tolist()
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    """Yield successive lists of up to `size` items"""
+    it = iter(items)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+def prefetch(items: Iterable, batch_size: int = PREFETCH_BATCH_SIZE,
+             depth: int = PREFETCH_DEPTH) -> Iterator:
+    """Iterate items produced on a background thread
+    
+    Parsing overlaps the SQLite writes of the consumer, which keeps the
+    connection on the calling thread. Producer errors are re-raised here.
+    """
+    batches = queue.Queue(maxsize=depth)
+    done = object()
+    errors = []
+    
+    def produce():
+        try:
+            for batch in batched(items, batch_size):
+                batches.put(batch)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            batches.put(done)
+    
+    reader = threading.Thread(target=produce, name="chunk-reader", daemon=True)
+    reader.start()
+    while True:
+        batch = batches.get()
+        if batch is done:
+            break
+        yield from batch
+    reader.join()
+    if errors:
+        raise errors[0]
+
+def append_embedding_rows(matrix_file: BinaryIO, embeddings: np.ndarray):
+    """Append embeddings as contiguous float16 rows of the (N, dim) matrix file"""
+    np.asarray(embeddings, dtype=np.float16).tofile(matrix_file)
+
+def iter_chunks(chunks_file: Path) -> Iterator[dict]:
+    """Stream chunks from Parquet + .npy embeddings, or from a legacy JSON file"""
+    if chunks_file.suffix == '.json':
+        with open(chunks_file, 'rb') as f:
+            yield from ijson.items(f, 'item', use_float=True, buf_size=JSON_READ_SIZE)
+        return
+    
+    # Embedding rows are aligned with chunks by embedding_idx
+    embeddings_file = chunks_file.with_name(EMBEDDINGS_FILE)
+    embeddings = np.load(embeddings_file, mmap_mode='r') if embeddings_file.exists() else None
+    for record_batch in pq.ParquetFile(chunks_file).iter_batches(batch_size=BATCH_SIZE):
+        for chunk in record_batch.to_pylist():
+            idx = chunk.pop('embedding_idx', None)
+            chunk['embedding'] = embeddings[idx] if embeddings is not None and idx is not None else None
+            yield chunk
 
 # ============================================
 # Database Builder
 # ============================================
 
 class DatabaseBuilder:
-    def __init__(self, db_path: Path):
+    def __init__(self, db_path: Path, bulk: bool = False, in_memory: bool = False,
+                 upsert: bool = True, vector_index: bool = False):
         self.db_path = db_path
-        self.conn = sqlite3.connect(str(db_path))
-        self.conn.execute("PRAGMA journal_mode=WAL")
-        self.conn.execute("PRAGMA synchronous=NORMAL")
-        self.conn.execute("PRAGMA cache_size=10000")
+        self.bulk = bulk
+        self.in_memory = in_memory
+        # Plain INSERTs skip the delete-before-insert lookup of OR REPLACE, but
+        # are only safe when the tables start out empty
+        self.upsert = upsert
+        self.insert_sutta_sql = as_upsert(INSERT_SUTTA_SQL) if upsert else INSERT_SUTTA_SQL
+        self.insert_chunk_sql = as_upsert(INSERT_CHUNK_SQL) if upsert else INSERT_CHUNK_SQL
+        self.insert_emb_sql = as_upsert(INSERT_EMB_SQL) if upsert else INSERT_EMB_SQL
+        # The matrix always lives beside the target file, even for in-memory builds
+        self.embedding_matrix_path = db_path.with_suffix(EMBEDDING_MATRIX_SUFFIX)
+        self.embedding_dimensions = None
+        # Next free row of the matrix file; seeded on the first load
+        self.matrix_rows = None
+        # Whether this builder created the matrix file (and may delete it)
+        self.created_matrix = False
+        # Rows written by this builder
+        self.n_suttas = 0
+        self.n_chunks = 0
+        self.n_embeddings = 0
+        # sqlite_stat1 only reflects the data once this builder has analyzed it
+        self.analyzed = False
+        self.conn = sqlite3.connect(":memory:" if in_memory else str(db_path))
+        if bulk:
+            # Bulk-load tuning: no journal, no fsync, single writer. Only for
+            # fresh builds that are redone from scratch on failure and end with
+            # restore_safe_pragmas(); page_size must precede the schema.
+            self.conn.executescript("""
+                PRAGMA page_size=8192;
+                PRAGMA journal_mode=OFF;
+                PRAGMA synchronous=OFF;
+                PRAGMA locking_mode=EXCLUSIVE;
+                PRAGMA temp_store=MEMORY;
+                PRAGMA cache_size=-131072;
+                PRAGMA mmap_size=1073741824;
+            """)
+        else:
+            self.conn.executescript("""
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+                PRAGMA temp_store=MEMORY;
+                PRAGMA mmap_size=268435456;
+            """)
+        # The vec0 table is created with the first embedded batch
+        self.vec_enabled = vector_index and self._load_sqlite_vec()
+        self.vec_table_ready = False
+    
+    def _load_sqlite_vec(self) -> bool:
+        """Load the sqlite-vec extension when it and extension loading are available"""
+        if sqlite_vec is None or not hasattr(self.conn, 'enable_load_extension'):
+            print("Warning: skipping vector index; sqlite-vec needs the sqlite_vec "
+                  "package and a sqlite3 build with extension loading")
+            return False
+        try:
+            self.conn.enable_load_extension(True)
+            sqlite_vec.load(self.conn)
+        except sqlite3.OperationalError as e:
+            print(f"Warning: skipping vector index; could not load sqlite-vec: {e}")
+            return False
+        finally:
+            self.conn.enable_load_extension(False)
+        return True
+    
+    def restore_safe_pragmas(self):
+        """Switch a bulk-loaded database back to the reader-safe settings it ships with"""
+        self.conn.executescript("""
+            PRAGMA locking_mode=NORMAL;
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+        """)
+        # The exclusive lock is only released on the next access
+        self.conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
         
     def create_schema(self):
-        """Create database schema"""
-        print("Creating database schema...")
-        self.conn.executescript(SCHEMA_SQL)
+        """Create the full schema, with FTS sync triggers, for incremental loads"""
+        self.create_schema_tables()
+        self.create_schema_indexes()
+        self.conn.executescript(FTS_TRIGGERS_SQL)
+    
+    def create_schema_tables(self):
+        """Create tables only, ahead of a bulk load"""
+        print("Creating database tables...")
+        self.conn.executescript(SCHEMA_TABLES_SQL)
+    
+    def create_schema_indexes(self):
+        """Create secondary indexes and the FTS table over the loaded data"""
+        print("Creating indexes...")
+        self.conn.executescript(SCHEMA_INDEXES_SQL)
+    
+    def rebuild_fts(self):
+        """Populate FTS from suttas in one pass, then restore the sync triggers"""
+        print("Building full-text index...")
+        self.conn.execute("INSERT INTO suttas_fts(suttas_fts) VALUES('rebuild')")
+        self.conn.execute("INSERT INTO suttas_fts(suttas_fts) VALUES('optimize')")
         self.conn.commit()
+        self.conn.executescript(FTS_TRIGGERS_SQL)
+        
+    def backup_to_disk(self):
+        """Snapshot an in-memory build to db_path in one sequential write
+        
+        The backup is already tightly packed, so no VACUUM is needed.
+        """
+        print(f"Writing database to {self.db_path}...")
+        remove_database(self.db_path)
+        with closing(sqlite3.connect(str(self.db_path))) as dst:
+            self.conn.backup(dst, pages=-1)
+            dst.execute("PRAGMA journal_mode=WAL")
+    
+    def begin(self):
+        """Open the write transaction that spans a whole load"""
+        if not self.conn.in_transaction:
+            self.conn.execute("BEGIN IMMEDIATE")
+    
+    def commit(self):
+        """Commit the current load transaction"""
+        self.conn.commit()
+    
+    def _open_embedding_matrix(self) -> BinaryIO:
+        """Open the float16 matrix file for this load's embedding rows
         
+        A fresh builder truncates it on its first load. Later loads, and every
+        upserting builder, append after the rows already in the file so
+        existing chunks.embedding_row values stay valid.
+        """
+        path = self.embedding_matrix_path
+        if self.matrix_rows is None:
+            self.matrix_rows = 0
+            if not self.upsert:
+                self.created_matrix = True
+                return open(path, 'wb')
+            if path.exists():
+                row = self.conn.execute(
+                    "SELECT value FROM metadata WHERE key = 'embedding_dimensions'"
+                ).fetchone()
+                if row:
+                    self.embedding_dimensions = int(row[0])
+                    self.matrix_rows = path.stat().st_size // (2 * self.embedding_dimensions)
+                else:
+                    (last,) = self.conn.execute("SELECT MAX(embedding_row) FROM chunks").fetchone()
+                    self.matrix_rows = 0 if last is None else last + 1
+        if not path.exists():
+            self.created_matrix = True
+        return open(path, 'ab')
+    
+    def commit_batch(self):
+        """Commit the rows written so far and reopen the load transaction"""
+        self.commit()
+        self.begin()
+    
     def set_metadata(self, key: str, value: str):
         """Set metadata key-value"""
         self.conn.execute(
@@ -186,31 +495,30 @@ class DatabaseBuilder:
         """Insert sutta data from JSON"""
         print(f"Loading suttas from {suttas_file}")
         
-        # Load extracted suttas
-        with open(suttas_file, 'r', encoding='utf-8') as f:
+        # Stream extracted suttas; the first item tells the two formats apart
+        with open(suttas_file, 'rb') as f:
             # Try chunks file first, then extracted file
             try:
-                data = json.load(f)
-                if isinstance(data, list) and len(data) > 0:
-                    if 'content' in data[0]:  # Chunks format
-                        return self._insert_from_chunks(data)
+                items = ijson.items(f, 'item', use_float=True, buf_size=JSON_READ_SIZE)
+                first = next(items, None)
+                if first is not None:
+                    items = chain([first], items)
+                    self.begin()
+                    if 'content' in first:  # Chunks format
+                        self._insert_from_chunks(items)
                     else:  # Suttas format
-                        return self._insert_suttas_list(data)
+                        self._insert_suttas_list(items)
+                    self.commit()
             except:
                 pass
         
-    def _insert_suttas_list(self, suttas: List[dict]):
-        """Insert list of suttas"""
-        print(f"Inserting {len(suttas)} suttas...")
+    def _insert_suttas_list(self, suttas: Iterable[dict], batch_size: int = BATCH_SIZE):
+        """Insert a stream of suttas"""
+        print("Inserting suttas...")
         
         cursor = self.conn.cursor()
-        
-        for sutta in tqdm(suttas, desc="Inserting suttas"):
-            cursor.execute("""
-                INSERT OR REPLACE INTO suttas 
-                (id, sutta_id, title_thai, title_pali, pitaka, nikaya, vagga, content_thai)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
+        rows = (
+            (
                 sutta['id'],
                 sutta.get('sutta_id', ''),
                 sutta['title_thai'],
@@ -219,144 +527,247 @@ class DatabaseBuilder:
                 sutta['nikaya'],
                 sutta.get('vagga'),
                 sutta['content_thai']
-            ))
+            )
+            for sutta in tqdm(suttas, desc="Inserting suttas")
+        )
         
-        self.conn.commit()
+        for batch in batched(rows, batch_size):
+            cursor.executemany(self.insert_sutta_sql, batch)
+            self.n_suttas += len(batch)
+            self.analyzed = False
+            self.commit_batch()
+        
+    def _insert_from_chunks(self, chunks: Iterable[dict], batch_size: int = BATCH_SIZE):
+        """Insert data from a stream of chunks
         
-    def _insert_from_chunks(self, chunks: List[dict]):
-        """Insert data from chunks format"""
-        print(f"Inserting from {len(chunks)} chunks...")
+        Chunks and embeddings are written and committed batch_size rows at a
+        time as they arrive; only each sutta's metadata and chunk texts are
+        kept to rebuild it afterwards.
+        """
+        print("Inserting from chunks...")
         
-        # Group by source_id
+        # source_id -> {'meta': sutta columns, 'parts': [(chunk_index, content)]}
         suttas = {}
-        for chunk in chunks:
-            source_id = chunk['source_id']
-            if source_id not in suttas:
-                suttas[source_id] = {
-                    'id': source_id,
-                    'sutta_id': chunk.get('sutta_id', source_id),
-                    'title_thai': chunk.get('title_thai', ''),
-                    'title_pali': chunk.get('title_pali'),
-                    'pitaka': chunk.get('pitaka', ''),
-                    'nikaya': chunk.get('nikaya', ''),
-                    'vagga': chunk.get('vagga'),
-                    'content_thai': '',
-                    'chunks': []
-                }
-            suttas[source_id]['chunks'].append(chunk)
+        n_embeddings = self.n_embeddings
+        with self._open_embedding_matrix() as matrix_file:
+            for batch in batched(tqdm(chunks, desc="Inserting chunks", unit="chunk"),
+                                 batch_size):
+                # Hottest Python loop of the build: bind lookups to locals
+                get_sutta = suttas.get
+                for chunk in batch:
+                    g = chunk.get
+                    source_id = chunk['source_id']
+                    sutta = get_sutta(source_id)
+                    if sutta is None:
+                        sutta = suttas[source_id] = {
+                            'meta': (
+                                source_id,
+                                g('sutta_id', source_id),
+                                g('title_thai', ''),
+                                g('title_pali'),
+                                g('pitaka', ''),
+                                g('nikaya', ''),
+                                g('vagga'),
+                            ),
+                            'parts': []
+                        }
+                    sutta['parts'].append((chunk['chunk_index'], chunk['content']))
+                self.insert_chunks(batch, matrix_file)
+                self.commit_batch()
+        
+        if self.n_embeddings > n_embeddings:
+            self.set_metadata('embedding_model', EMBEDDING_MODEL)
+            self.set_metadata('embedding_dimensions', str(self.embedding_dimensions))
+            self.set_metadata('embedding_quant', 'int8_per_row')
+            self.set_metadata('embedding_matrix', self.embedding_matrix_path.name)
+            self.set_metadata('embedding_matrix_dtype', 'float16')
+            if self.vec_table_ready:
+                (version,) = self.conn.execute("SELECT vec_version()").fetchone()
+                self.set_metadata('vector_index', VECTOR_INDEX_TABLE)
+                self.set_metadata('vector_index_metric', VECTOR_INDEX_METRIC)
+                self.set_metadata('vector_extension', 'sqlite-vec')
+                self.set_metadata('vector_extension_version', version)
+        elif self.created_matrix and not self.matrix_rows:
+            # Only drop an empty matrix this builder created itself
+            self.embedding_matrix_path.unlink()
+            self.created_matrix = False
+            self.matrix_rows = None
         
         # Reconstruct full content and insert
         cursor = self.conn.cursor()
         
-        for source_id, sutta in tqdm(suttas.items(), desc="Inserting suttas"):
-            # Sort chunks by index
-            sorted_chunks = sorted(sutta['chunks'], key=lambda x: x['chunk_index'])
-            full_content = '\n\n'.join(c['content'] for c in sorted_chunks)
-            
-            # Insert sutta
-            cursor.execute("""
-                INSERT OR REPLACE INTO suttas 
-                (id, sutta_id, title_thai, title_pali, pitaka, nikaya, vagga, content_thai)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                sutta['id'],
-                sutta['sutta_id'],
-                sutta['title_thai'],
-                sutta['title_pali'],
-                sutta['pitaka'],
-                sutta['nikaya'],
-                sutta['vagga'],
-                full_content
-            ))
+        by_index = itemgetter(0)
+        content_of = itemgetter(1)
         
-        self.conn.commit()
-        return self.insert_chunks(chunks)
+        def sutta_rows():
+            for sutta in tqdm(suttas.values(), desc="Inserting suttas"):
+                parts = sutta.pop('parts')
+                if len(parts) == 1:
+                    content = parts[0][1]
+                else:
+                    parts.sort(key=by_index)
+                    content = '\n\n'.join(map(content_of, parts))
+                row = sutta['meta'] + (content,)
+                # Release this sutta's texts before building the next row
+                del parts
+                yield row
+        
+        for batch in batched(sutta_rows(), batch_size):
+            cursor.executemany(self.insert_sutta_sql, batch)
+            self.n_suttas += len(batch)
+            self.analyzed = False
+            self.commit_batch()
         
-    def insert_chunks(self, chunks: List[dict]):
-        """Insert chunks and embeddings"""
-        print(f"Inserting {len(chunks)} chunks...")
+    def insert_chunks(self, chunks: List[dict], matrix_file: BinaryIO):
+        """Insert a batch of chunks and embeddings
         
+        Embeddings are appended to matrix_file, continuing its row numbering
+        from self.matrix_rows.
+        """
         cursor = self.conn.cursor()
-        embedding_model = None
         
-        for chunk in tqdm(chunks, desc="Inserting chunks"):
-            # Insert chunk
-            cursor.execute("""
-                INSERT OR REPLACE INTO chunks
-                (id, source_id, content, chunk_index, total_chunks, char_start, char_end,
-                 title_thai, title_pali, pitaka, nikaya, vagga)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                chunk['id'],
+        # Embedded chunks get consecutive rows in the float16 matrix
+        embedded = [c for c in chunks if c.get('embedding') is not None]
+        embedding_rows = {c['id']: self.matrix_rows + i for i, c in enumerate(embedded)}
+        if embedded:
+            # One contiguous float32 (n, dim) buffer feeds both the matrix and the BLOBs
+            dimensions = len(embedded[0]['embedding'])
+            emb_matrix = np.fromiter(
+                (c['embedding'] for c in embedded),
+                dtype=np.dtype((np.float32, dimensions)),
+                count=len(embedded)
+            )
+            append_embedding_rows(matrix_file, emb_matrix)
+            if self.vec_enabled:
+                self._insert_vectors(self.matrix_rows, emb_matrix)
+            self.matrix_rows += len(embedded)
+            self.embedding_dimensions = dimensions
+        
+        # Build parameter rows up front so the transaction only spans the DB calls
+        chunk_rows = []
+        append_row = chunk_rows.append
+        embedding_row_of = embedding_rows.get
+        for chunk in chunks:
+            g = chunk.get
+            chunk_id = chunk['id']
+            append_row((
+                chunk_id,
                 chunk['source_id'],
                 chunk['content'],
                 chunk['chunk_index'],
                 chunk['total_chunks'],
-                chunk.get('char_start', 0),
-                chunk.get('char_end', 0),
-                chunk.get('title_thai', ''),
-                chunk.get('title_pali'),
-                chunk.get('pitaka', ''),
-                chunk.get('nikaya', ''),
-                chunk.get('vagga')
+                g('char_start', 0),
+                g('char_end', 0),
+                g('title_thai', ''),
+                g('title_pali'),
+                g('pitaka', ''),
+                g('nikaya', ''),
+                g('vagga'),
+                embedding_row_of(chunk_id)
             ))
-            
-            # Insert embedding if present
-            if chunk.get('embedding'):
-                if embedding_model is None:
-                    embedding_model = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
-                
-                embedding_blob = embedding_to_blob(chunk['embedding'])
-                dimensions = len(chunk['embedding'])
-                
-                cursor.execute("""
-                    INSERT OR REPLACE INTO embeddings
-                    (chunk_id, embedding, dimensions, model)
-                    VALUES (?, ?, ?, ?)
-                """, (chunk['id'], embedding_blob, dimensions, embedding_model))
         
-        self.conn.commit()
+        # The whole batch is quantized at once; the BLOBs remain the
+        # on-device search path while the matrix serves bulk scoring.
+        emb_rows = []
+        if embedded:
+            blobs = embeddings_to_blobs(emb_matrix)
+            emb_rows = [
+                (c['id'], blob, dimensions, EMBEDDING_MODEL, 1)
+                for c, blob in zip(embedded, blobs)
+            ]
         
-        if embedding_model:
-            self.set_metadata('embedding_model', embedding_model)
-            self.set_metadata('embedding_dimensions', str(dimensions))
+        cursor.executemany(self.insert_chunk_sql, chunk_rows)
+        cursor.executemany(self.insert_emb_sql, emb_rows)
+        self.n_chunks += len(chunk_rows)
+        self.n_embeddings += len(emb_rows)
+        self.analyzed = False
+    
+    def _insert_vectors(self, first_row: int, emb_matrix: np.ndarray):
+        """Add a batch's float32 embeddings to the vec0 table, keyed by matrix row"""
+        dimensions = emb_matrix.shape[1]
+        if not self.vec_table_ready:
+            if not self.upsert:
+                self.conn.execute(f"DROP TABLE IF EXISTS {VECTOR_INDEX_TABLE}")
+            self.conn.execute(f"""
+                CREATE VIRTUAL TABLE IF NOT EXISTS {VECTOR_INDEX_TABLE} USING vec0(
+                    embedding float[{dimensions}] distance_metric={VECTOR_INDEX_METRIC}
+                )
+            """)
+            self.vec_table_ready = True
+        
+        stride = dimensions * 4
+        block = np.ascontiguousarray(emb_matrix, dtype='<f4')
+        buf = memoryview(block.reshape(-1).view(np.uint8))
+        self.conn.executemany(INSERT_VEC_SQL, (
+            (first_row + i, buf[i * stride:(i + 1) * stride])
+            for i in range(len(block))
+        ))
     
     def vacuum(self):
-        """Optimize database"""
+        """Optimize database (runs in autocommit, outside the load transaction)"""
         print("Optimizing database...")
+        # Fold any WAL content into the main file before it is rewritten
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
         self.conn.execute("VACUUM")
-        self.conn.commit()
         
     def analyze(self):
         """Analyze database for query optimization"""
         print("Analyzing database...")
         self.conn.execute("ANALYZE")
-        self.conn.commit()
+        self.analyzed = True
         
     def close(self):
         """Close database connection"""
         self.conn.close()
         
-    def get_stats(self) -> dict:
-        """Get database statistics"""
-        cursor = self.conn.cursor()
-        
-        stats = {}
-        
-        cursor.execute("SELECT COUNT(*) FROM suttas")
-        stats['suttas_count'] = cursor.fetchone()[0]
+    def _table_row_counts(self) -> dict:
+        """Row counts of the content tables
         
-        cursor.execute("SELECT COUNT(*) FROM chunks")
-        stats['chunks_count'] = cursor.fetchone()[0]
+        sqlite_stat1 is trusted only if this builder ran analyze() after its
+        last write; otherwise the tables are counted directly.
+        """
+        cursor = self.conn.cursor()
+        row_counts = {}
+        if self.analyzed:
+            cursor.execute("""
+                SELECT tbl, stat FROM sqlite_stat1
+                WHERE tbl IN ('suttas', 'chunks', 'embeddings')
+            """)
+            for table, stat in cursor.fetchall():
+                row_counts[table] = int(stat.split()[0])
+        for table in ('suttas', 'chunks', 'embeddings'):
+            if table not in row_counts:
+                row_counts[table] = cursor.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        return row_counts
+    
+    def get_stats(self) -> dict:
+        """Get database statistics
         
-        cursor.execute("SELECT COUNT(*) FROM embeddings")
-        stats['embeddings_count'] = cursor.fetchone()[0]
+        A fresh build reports the row counts it kept while inserting; an
+        upserting builder may have replaced rows, so it reads them back.
+        """
+        cursor = self.conn.cursor()
         
-        cursor.execute("SELECT pitaka, COUNT(*) FROM suttas GROUP BY pitaka")
-        stats['by_pitaka'] = dict(cursor.fetchall())
+        if self.upsert:
+            row_counts = self._table_row_counts()
+        else:
+            row_counts = {
+                'suttas': self.n_suttas,
+                'chunks': self.n_chunks,
+                'embeddings': self.n_embeddings,
+            }
+        stats = {f'{table}_count': count for table, count in row_counts.items()}
         
-        cursor.execute("SELECT nikaya, COUNT(*) FROM suttas GROUP BY nikaya")
-        stats['by_nikaya'] = dict(cursor.fetchall())
+        # Both breakdowns in one statement, demultiplexed by key
+        stats['by_pitaka'] = {}
+        stats['by_nikaya'] = {}
+        cursor.execute("""
+            SELECT 'by_pitaka', pitaka, COUNT(*) FROM suttas GROUP BY pitaka
+            UNION ALL
+            SELECT 'by_nikaya', nikaya, COUNT(*) FROM suttas GROUP BY nikaya
+        """)
+        for key, value, count in cursor.fetchall():
+            stats[key][value] = count
         
         return stats
 
@@ -367,22 +778,33 @@ class DatabaseBuilder:
 def build_database(
     chunks_file: Path,
     output_path: Path,
-    metadata: Optional[dict] = None
+    metadata: Optional[dict] = None,
+    in_memory: bool = False,
+    vector_index: bool = False
 ):
-    """Build SQLite database from processed chunks"""
+    """Build SQLite database from processed chunks
+    
+    The database is always built fresh: any existing output_path is replaced,
+    so rows are written with plain INSERTs. With in_memory the whole build
+    runs in RAM and is backed up to output_path at the end. vector_index adds
+    an optional sqlite-vec kNN table, which the app itself does not use.
+    """
     
     print(f"Building database: {output_path}")
     
-    # Load chunks
-    print(f"Loading chunks from {chunks_file}")
-    with open(chunks_file, 'r', encoding='utf-8') as f:
-        chunks = json.load(f)
+    # Chunks are parsed on a reader thread and streamed straight into the database
+    print(f"Reading chunks from {chunks_file}")
+    chunks = prefetch(iter_chunks(chunks_file))
     
-    print(f"Loaded {len(chunks)} chunks")
+    # Create a fresh database
+    if not in_memory:
+        remove_database(output_path)
+    builder = DatabaseBuilder(output_path, bulk=True, in_memory=in_memory, upsert=False,
+                              vector_index=vector_index)
+    builder.create_schema_tables()
     
-    # Create database
-    builder = DatabaseBuilder(output_path)
-    builder.create_schema()
+    # The load runs in a transaction that is committed every BATCH_SIZE rows
+    builder.begin()
     
     # Set metadata
     builder.set_metadata('version', '1.0.0')
@@ -392,12 +814,19 @@ def build_database(
         for key, value in metadata.items():
             builder.set_metadata(key, value)
     
-    # Insert data
+    # Insert data, then build indexes over it
     builder._insert_from_chunks(chunks)
+    builder.commit()
+    builder.create_schema_indexes()
+    builder.rebuild_fts()
     
-    # Optimize
+    # Optimize (statistics are gathered once the indexes exist)
     builder.analyze()
-    builder.vacuum()
+    if in_memory:
+        builder.backup_to_disk()
+    else:
+        builder.vacuum()
+        builder.restore_safe_pragmas()
     
     # Get stats
     stats = builder.get_stats()
@@ -425,14 +854,20 @@ def build_database(
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Build SQLite database')
     parser.add_argument('--input', '-i', type=str,
-                        default=str(INPUT_DIR / "tripitaka_chunks.json"),
-                        help='Input chunks JSON file')
+                        default=str(INPUT_DIR / CHUNKS_FILE),
+                        help='Input chunks file (.parquet, or legacy .json)')
     parser.add_argument('--output', '-o', type=str,
                         default=str(OUTPUT_DIR / DB_NAME),
                         help='Output database file')
+    parser.add_argument('--in-memory', action='store_true',
+                        help='Build in RAM and back up to the output file at the end')
+    parser.add_argument('--vector-index', action='store_true',
+                        help='Also build a sqlite-vec kNN table (float32, not read by the app)')
     args = parser.parse_args()
     
     build_database(
         chunks_file=Path(args.input),
-        output_path=Path(args.output)
+        output_path=Path(args.output),
+        in_memory=args.in_memory,
+        vector_index=args.vector_index
     )
@@ -394,9 +394,19 @@ class DatabaseService {
 
   /**
    * Convert binary blob to number vector
+   * Bundled embeddings are int8: a float32 scale followed by one int8 per
+   * dimension (dimensions + 4 bytes). User embeddings are plain float32.
    */
   private blobToVector(blob: Uint8Array, dimensions: number): number[] {
-    const view = new Float32Array(blob.buffer || blob);
+    const buffer = (blob.buffer || blob) as ArrayBuffer;
+
+    if (buffer.byteLength === dimensions + 4) {
+      const scale = new DataView(buffer).getFloat32(0, true);
+      const quantized = new Int8Array(buffer, 4, dimensions);
+      return Array.from(quantized, (v) => v * scale);
+    }
+
+    const view = new Float32Array(buffer);
     return Array.from(view);
   }
 